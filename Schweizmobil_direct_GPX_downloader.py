@@ -21,17 +21,91 @@ Features:
 Requirements:
 - requests
 - pyproj
+- orjson (optional, faster JSON parsing)
 
 Author Philipp Kündig, 16. May 2025
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import getpass
-from pyproj import Transformer
 import datetime
+import functools
 import os
+from xml.sax.saxutils import escape
+
+# orjson is optional, it parses the large profile arrays considerably faster
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Explicit LV03 (EPSG:21781) -> WGS84 (EPSG:4326) pipeline, so PROJ does not have
+# to look up and pick a transformation from its database. Output is (lon, lat).
+LV03_TO_WGS84_PIPELINE = (
+    "+proj=pipeline"
+    " +step +inv +proj=somerc +lat_0=46.9524055555556 +lon_0=7.43958333333333"
+    " +k_0=1 +x_0=600000 +y_0=200000 +ellps=bessel"
+    " +step +proj=push +v_3"
+    " +step +proj=cart +ellps=bessel"
+    " +step +proj=helmert +x=674.374 +y=15.056 +z=405.346"
+    " +step +inv +proj=cart +ellps=WGS84"
+    " +step +proj=pop +v_3"
+    " +step +proj=unitconvert +xy_in=rad +xy_out=deg"
+)
+
+# Maximum number of track details fetched in parallel
+DETAIL_WORKERS = 8
+
+# GPX templates, filled with the % operator in write_gpx
+GPX_OPEN = (
+    '<?xml version="1.0"?>\n'
+    '<gpx version="1.1" creator="schweizmobil.ch-API converter">\n'
+    '  <metadata><name>%s</name></metadata>\n'
+)
+TRK_OPEN = '  <trk><name>%s</name><trkseg>\n'
+GPX_CLOSE = '  </trkseg></trk>\n</gpx>\n'
+WPT = '  <wpt lat="%.10f" lon="%.10f">\n    <ele></ele>\n    <name>%s</name>\n  </wpt>\n'
+TRKPT = '    <trkpt lat="%.10f" lon="%.10f"><ele>%.1f</ele></trkpt>\n'
+
+@functools.lru_cache(maxsize=None)
+def get_transformer():
+    """
+    Return the LV03->WGS84 pyproj Transformer, created once and reused afterwards.
+    pyproj is imported here so that --help and early errors don't pay for loading PROJ.
+    """
+    # No grid files are needed for the LV03 pipeline, never download any.
+    # Must be set before pyproj is imported.
+    os.environ.setdefault("PROJ_NETWORK", "OFF")
+    from pyproj import Transformer
+    return Transformer.from_pipeline(LV03_TO_WGS84_PIPELINE)
+
+class ApproxLV03Transformer:
+    """
+    LV03->WGS84 conversion with the approximate formulas published by swisstopo.
+    Accurate to about 1 m, which is well below GPS noise, and needs no pyproj.
+    Has the same transform() interface as the pyproj Transformer, returning (lon, lat).
+    """
+
+    def transform(self, eastings, northings):
+        lons = []
+        lats = []
+        for easting, northing in zip(eastings, northings):
+            # Auxiliary values, relative to Bern, in 1000 km
+            y = (easting - 600000) / 1000000
+            x = (northing - 200000) / 1000000
+            y2 = y * y
+            x2 = x * x
+            # Results in 10000" units, converted to degrees
+            lons.append((2.6779094 + 4.728982 * y + 0.791484 * y * x
+                         + 0.1306 * y * x2 - 0.0436 * y2 * y) * 100 / 36)
+            lats.append((16.9023892 + 3.238272 * x - 0.270978 * y2 - 0.002528 * x2
+                         - 0.0447 * y2 * x - 0.0140 * x2 * x) * 100 / 36)
+        return lons, lats
 
 def lv03_to_wgs84(easting, northing, transformer):
     """
@@ -44,7 +118,62 @@ def parse_profile(profile_str):
     """
     Parse the 'profile' string from the API, which is a list of [easting, northing, elevation, distance].
     """
-    return json.loads(profile_str.replace("'", '"'))
+    # Only copy the (possibly multi-MB) string if it actually uses single quotes
+    if "'" in profile_str:
+        profile_str = profile_str.replace("'", '"')
+    return json_loads(profile_str)
+
+def simplify_profile(points, tolerance):
+    """
+    Reduce the track points with the Douglas-Peucker algorithm.
+    Works on the LV03 easting/northing values, so the tolerance is in meters.
+    Elevation and distance of the kept points are preserved.
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        x1, y1 = points[start][0], points[start][1]
+        dx = points[end][0] - x1
+        dy = points[end][1] - y1
+        seg_len_sq = dx * dx + dy * dy
+        max_dist_sq = 0.0
+        max_idx = None
+        for i in range(start + 1, end):
+            px = points[i][0] - x1
+            py = points[i][1] - y1
+            # Distance to the segment, not the infinite line, so that points beyond
+            # an endpoint (e.g. the turnaround of an out-and-back track) are kept
+            if seg_len_sq == 0:
+                t = 0.0
+            else:
+                t = min(1.0, max(0.0, (px * dx + py * dy) / seg_len_sq))
+            ex = px - t * dx
+            ey = py - t * dy
+            dist_sq = ex * ex + ey * ey
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                max_idx = i
+        if max_idx is not None and max_dist_sq > tolerance * tolerance:
+            keep[max_idx] = True
+            stack.append((start, max_idx))
+            stack.append((max_idx, end))
+    return [pt for pt, k in zip(points, keep) if k]
+
+def non_negative_float(value):
+    """
+    argparse type for options that take a distance, e.g. --simplify.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: '{value}'")
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: '{value}'")
+    return number
 
 def write_gpx(track_name, points, via_points, output_file, transformer):
     """
@@ -55,27 +184,50 @@ def write_gpx(track_name, points, via_points, output_file, transformer):
     - output_file: Output GPX filename
     - transformer: pyproj Transformer for LV03->WGS84
     """
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write('<?xml version="1.0"?>\n')
-        f.write('<gpx version="1.1" creator="schweizmobil.ch-API converter">\n')
-        f.write(f'  <metadata><name>{track_name}</name></metadata>\n')
-        # Write via_points as waypoints
-        for idx, pt in enumerate(via_points):
-            easting, northing = pt
-            lat, lon = lv03_to_wgs84(easting, northing, transformer)
-            name = "Starting point" if idx == 0 else ("Destination" if idx == len(via_points) - 1 else "Waypoint")
-            f.write(f'  <wpt lat="{lat:.10f}" lon="{lon:.10f}">\n')
-            f.write(f'    <ele></ele>\n')
-            f.write(f'    <name>{name}</name>\n')
-            f.write('  </wpt>\n')
-        # Write track points
-        f.write(f'  <trk><name>{track_name}</name><trkseg>\n')
-        for pt in points:
-            easting, northing, elevation, _ = pt
-            lat, lon = lv03_to_wgs84(easting, northing, transformer)
-            f.write(f'    <trkpt lat="{lat:.10f}" lon="{lon:.10f}"><ele>{elevation:.1f}</ele></trkpt>\n')
-        f.write('  </trkseg></trk>\n')
-        f.write('</gpx>\n')
+    # Transform all coordinates in one call per point list instead of once per point
+    # Split into coordinate columns once, so no per-point unpacking is needed below
+    via_eastings, via_northings = zip(*via_points) if via_points else ((), ())
+    eastings, northings, elevations, _ = zip(*points) if points else ((), (), (), ())
+    via_lons, via_lats = transformer.transform(via_eastings, via_northings)
+    lons, lats = transformer.transform(eastings, northings)
+    # Track names are user-chosen and may contain XML special characters
+    xml_name = escape(track_name)
+    # Collect all lines and write them in one go instead of one write per line
+    parts = [GPX_OPEN % xml_name]
+    # Via_points as waypoints
+    for idx, (lat, lon) in enumerate(zip(via_lats, via_lons)):
+        name = "Starting point" if idx == 0 else ("Destination" if idx == len(via_points) - 1 else "Waypoint")
+        parts.append(WPT % (lat, lon, name))
+    # Track points
+    parts.append(TRK_OPEN % xml_name)
+    for lat, lon, elevation in zip(lats, lons, elevations):
+        parts.append(TRKPT % (lat, lon, elevation))
+    parts.append(GPX_CLOSE)
+    # Encode once and write the bytes directly, bypassing the text layer
+    with open(output_file, "wb", buffering=1 << 20) as f:
+        f.write("".join(parts).encode("utf-8"))
+
+def fetch_track_detail(session, pre, track_id):
+    """
+    Fetch the details of a track from the API.
+    Returns the parsed track, or None if the request failed.
+    The response body is not kept around, only the parsed result.
+    """
+    response = session.get(pre + '/api/4/tracks/' + str(track_id))
+    if response.status_code != 200:
+        return None
+    return json_loads(response.content)
+
+def format_datetime(value):
+    """
+    Format an ISO date/time string from the API for user-friendly display (dd.mm.yyyy HH:MM).
+    Returns the value unchanged if it can't be parsed.
+    """
+    try:
+        dt = datetime.datetime.fromisoformat(value)
+    except Exception:
+        return value
+    return f"{dt.day:02d}.{dt.month:02d}.{dt.year} {dt.hour:02d}:{dt.minute:02d}"
 
 def load_credentials_from_file(filepath):
     """
@@ -83,6 +235,8 @@ def load_credentials_from_file(filepath):
     The file should contain two lines:
         username=your_username
         password=your_password
+    Lines starting with # and lines without '=' are ignored, as are keys other
+    than username and password. If a key appears more than once, the last value wins.
 
     Returns a dict with 'username' and 'password', or None if missing or malformed.
     """
@@ -91,19 +245,17 @@ def load_credentials_from_file(filepath):
         return None
     with open(filepath, "r", encoding="utf-8") as f:
         for line in f:
-            if "=" in line:
-                key, value = line.strip().split("=", 1)
-                creds[key.strip()] = value.strip()
-    # Check for missing or empty values and extra keys
-    if (
-        "username" in creds and creds["username"]
-        and "password" in creds and creds["password"]
-        and len(creds) == 2
-    ):
-        return creds
+            line = line.strip()
+            if line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            creds[key.strip()] = value.strip()
+    # Check for missing or empty values, other keys are ignored
+    if creds.get("username") and creds.get("password"):
+        return {"username": creds["username"], "password": creds["password"]}
     print(
         f"Credentials file '{filepath}' is missing required fields or is malformed.\n"
-        "It should contain exactly two lines:\n"
+        "It should contain these two lines:\n"
         "username=your_username\npassword=your_password"
     )
     return None
@@ -129,6 +281,14 @@ def main():
         "--credentials-file", "-c",
         help="Path to a file containing username and password (format: username=... and password=...)"
     )
+    parser.add_argument(
+        "--fast-transform", action="store_true",
+        help="Convert coordinates with swisstopo's approximate formulas (about 1 m accuracy) instead of pyproj"
+    )
+    parser.add_argument(
+        "--simplify", "-s", type=non_negative_float, metavar="METERS",
+        help="Simplify the track, dropping points that deviate less than METERS from the line (Douglas-Peucker)"
+    )
     args = parser.parse_args()
 
     creds = {}
@@ -163,7 +323,24 @@ def main():
 
     pre = 'https://map.schweizmobil.ch'
     session = requests.Session()
-    session.headers = {}
+    # Only ask for compressed responses, the track payloads are large JSON documents
+    session.headers = {"Accept-Encoding": "gzip, deflate"}
+    # Keep-alive pool large enough for the parallel detail requests, retry transient failures
+    adapter = HTTPAdapter(
+        pool_connections=DETAIL_WORKERS,
+        pool_maxsize=DETAIL_WORKERS,
+        # Retry connection errors and temporary server errors. Status and read-error retries
+        # only apply to idempotent methods, so the login POST is not sent twice. Once retries
+        # are used up the last response is returned and the status checks below handle it.
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
     # Authenticate
     payload = json.dumps({
@@ -180,10 +357,7 @@ def main():
     if response.status_code != 200:
         print("Failed to fetch tracks. Please check your connection or credentials.")
         exit(1)
-    tracks = response.json()
-
-    # LV03 (EPSG:21781) to WGS84 (EPSG:4326)
-    transformer = Transformer.from_crs(21781, 4326, always_xy=True)
+    tracks = json_loads(response.content)
 
     # Find all tracks with the given name
     matching_tracks = [t for t in tracks if t["name"] == track_name]
@@ -198,32 +372,26 @@ def main():
     # If multiple tracks with the same name, ask the user to choose
     if len(matching_tracks) > 1:
         print(f"\nMultiple tracks found with the name '{track_name}':")
-        # Fetch details for each matching track to show more info
-        detailed_tracks = []
-        for idx, t in enumerate(matching_tracks):
-            detail_response = session.get(pre + '/api/4/tracks/' + str(t['id']))
-            if detail_response.status_code == 200:
-                detail = detail_response.json()
+        # Fetch details for each matching track to show more info.
+        # All details are fetched in parallel, the results keep the order of matching_tracks.
+        with ThreadPoolExecutor(max_workers=DETAIL_WORKERS) as executor:
+            detailed_tracks = list(executor.map(
+                lambda t: fetch_track_detail(session, pre, t['id']),
+                matching_tracks
+            ))
+        for idx, (t, detail) in enumerate(zip(matching_tracks, detailed_tracks)):
+            if detail is not None:
                 props = detail.get("properties", {})
                 created = props.get('created_at', 'unknown')
                 modified = props.get('modified_at', 'unknown')
                 filter_name = props.get('filter_name', 'N/A')
 
-                # Format date/time for user-friendly display
-                def fmt(dt):
-                    try:
-                        return datetime.datetime.fromisoformat(dt).strftime("%d.%m.%Y %H:%M")
-                    except Exception:
-                        return dt
-
-                created_fmt = fmt(created)
-                modified_fmt = fmt(modified)
+                created_fmt = format_datetime(created)
+                modified_fmt = format_datetime(modified)
 
                 print(f"{idx+1}: {filter_name} | ID={t['id']} | Created: {created_fmt} | Modified: {modified_fmt}")
-                detailed_tracks.append(detail)
             else:
                 print(f"{idx+1}: (details unavailable) | ID={t['id']}")
-                detailed_tracks.append(None)
         while True:
             try:
                 choice = int(input(f"Select a track (1-{len(matching_tracks)}): "))
@@ -238,22 +406,33 @@ def main():
                     print("Invalid choice. Please try again.")
             except ValueError:
                 print("Invalid input. Please enter a number.")
-        # Use the already-fetched details
+        # Use the already-fetched details, drop the others
         track = selected_detail
+        del detailed_tracks
     else:
         selected_track = matching_tracks[0]
-        detail_response = session.get(pre + '/api/4/tracks/' + str(selected_track['id']))
-        if detail_response.status_code != 200:
-            print(f"Failed to fetch details for track '{track_name}'.")
-            exit(1)
-        track = detail_response.json()
+        props = selected_track.get("properties") or {}
+        if "profile" in props and "via_points" in props:
+            # The track list already contains everything needed, skip the detail request
+            track = selected_track
+        else:
+            track = fetch_track_detail(session, pre, selected_track['id'])
+            if track is None:
+                print(f"Failed to fetch details for track '{track_name}'.")
+                exit(1)
 
     # Fetch and export the selected track
     props = track["properties"]
-    profile_str = props['profile']
-    points = parse_profile(profile_str)
-    via_points = json.loads(props["via_points"])
+    # Pop the raw profile string so it can be freed once it is parsed
+    points = parse_profile(props.pop('profile'))
+    if args.simplify:
+        point_count = len(points)
+        points = simplify_profile(points, args.simplify)
+        print(f"Simplified track from {point_count} to {len(points)} points.")
+    via_points = json_loads(props["via_points"])
     output_file = f"{track_name}.gpx"
+    # LV03 (EPSG:21781) to WGS84 (EPSG:4326)
+    transformer = ApproxLV03Transformer() if args.fast_transform else get_transformer()
     write_gpx(track_name, points, via_points, output_file, transformer)
     print(f"\nGPX written: {output_file}")
 